@@ -4,17 +4,44 @@ Voice Assistant using whisper.cpp for STT, ollama for processing, and TTS for sp
 """
 
 import argparse
+import asyncio
 import json
+import logging
 import os
 import subprocess
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from pathlib import Path
 
-from modules.whisper_stt import transcribe_audio
-from modules.ollama_process import process_with_ollama
-from modules.tts import text_to_speech
-from modules.audio_input import record_audio
+from modules.config import load_config
+from modules.semantic_cache import get_semantic_cache
+from modules.whisper_stt import transcribe_audio, transcribe_audio_async, warm_up_whisper
+from modules.ollama_process import (
+    CONNECTION_ERROR_REPLY,
+    REQUEST_ERROR_REPLY,
+    check_ollama,
+    check_ollama_async,
+    close_async_session,
+    process_with_ollama,
+    process_with_ollama_async,
+    warm_up_ollama,
+)
+from modules.tts import (
+    playback_remaining,
+    stop_speech,
+    text_to_speech,
+    text_to_speech_async,
+    warm_up_tts,
+)
+from modules.audio_input import record_audio, record_audio_async, stop_recording
+
+log = logging.getLogger("va")
+log.setLevel(logging.INFO)
+
+# How often the speech worker checks whether buffered audio has played out
+PLAYBACK_POLL_S = 0.05
 
 def main():
     """Main entry point for the voice assistant."""
@@ -24,60 +51,280 @@ def main():
     parser.add_argument("--whisper-model", type=str, help="Whisper model to use")
     parser.add_argument("--tts-engine", type=str, help="TTS engine to use")
     parser.add_argument("--continuous", action="store_true", help="Run in continuous mode")
+    parser.add_argument("--quiet", action="store_true", help="Only log warnings and errors")
     args = parser.parse_args()
 
+    logging.basicConfig(format="%(message)s")
+    if args.quiet:
+        log.setLevel(logging.WARNING)
+
     # Load configuration
     config_path = Path(args.config)
     if not config_path.exists():
-        print(f"Config file not found: {args.config}")
+        log.warning("Config file not found: %s", args.config)
         create_default_config(args.config)
-        print(f"Created default config at {args.config}")
+        log.warning("Created default config at %s", args.config)
     
-    with open(config_path, "r") as f:
-        config = json.load(f)
+    try:
+        config = load_config(config_path)
+    except TypeError as e:
+        log.error("Invalid config file %s: %s", args.config, e)
+        sys.exit(1)
     
     # Override config with command line arguments
     if args.model:
-        config["ollama"]["model"] = args.model
+        config = replace(config, ollama=replace(config.ollama, model=args.model))
     if args.whisper_model:
-        config["whisper"]["model"] = args.whisper_model
+        config = replace(config, whisper=replace(config.whisper, model=args.whisper_model))
     if args.tts_engine:
-        config["tts"]["engine"] = args.tts_engine
+        config = replace(config, tts=replace(config.tts, engine=args.tts_engine))
 
-    print(f"Using whisper model: {config['whisper']['model']}")
-    print(f"Using ollama model: {config['ollama']['model']}")
-    print(f"Using TTS engine: {config['tts']['engine']}")
+    log.info("Using whisper model: %s", config.whisper.model)
+    log.info("Using ollama model: %s", config.ollama.model)
+    log.info("Using TTS engine: %s", config.tts.engine)
+    
+    warm_up(config)
     
     # Run voice assistant loop
     if args.continuous:
-        print("Running in continuous mode. Press Ctrl+C to exit.")
+        log.info("Running in continuous mode. Press Ctrl+C to exit.")
         try:
-            while True:
-                run_assistant(config)
+            asyncio.run(run_assistant_pipeline(config))
         except KeyboardInterrupt:
-            print("\nExiting voice assistant.")
+            log.info("\nExiting voice assistant.")
     else:
         run_assistant(config)
 
+def warm_up(config):
+    """Load all models up front so the first interaction isn't slowed by cold starts."""
+    log.info("Loading models...")
+    with ThreadPoolExecutor() as pool:
+        futures = [
+            pool.submit(warm_up_ollama, config.ollama),
+            pool.submit(get_semantic_cache, config.ollama.cache),
+            pool.submit(warm_up_whisper, config.whisper),
+            pool.submit(warm_up_tts, config.tts),
+        ]
+    
+    # A failed warm-up isn't fatal, the model just loads on first use instead
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            log.warning("Warm-up failed: %s", error, exc_info=error)
+
 def run_assistant(config):
     """Run a single interaction with the voice assistant."""
-    print("\nListening... (press Ctrl+C to stop)")
-    audio_file = record_audio(config["audio"])
+    # Check ollama is up while the user is speaking rather than afterwards
+    preflight = ThreadPoolExecutor(max_workers=1)
+    ollama_ready = preflight.submit(check_ollama, config.ollama)
+    preflight.shutdown(wait=False)
+    
+    log.info("\nListening... (press Ctrl+C to stop)")
+    audio = record_audio(config.audio)
     
-    print("Transcribing...")
-    transcript = transcribe_audio(audio_file, config["whisper"])
-    print(f"You said: {transcript}")
+    log.info("Transcribing...")
+    transcript = transcribe_audio(audio, config.whisper)
+    log.info("You said: %s", transcript)
     
     if not transcript.strip():
-        print("No speech detected. Please try again.")
+        log.info("No speech detected. Please try again.")
+        return
+    
+    if not ollama_ready.result():
+        text_to_speech(_echo([CONNECTION_ERROR_REPLY]), config.tts)
         return
     
-    print("Processing with Ollama...")
-    response = process_with_ollama(transcript, config["ollama"])
-    print(f"Assistant: {response}")
+    log.info("Processing with Ollama...")
+    response = process_with_ollama(transcript, config.ollama)
+    
+    log.info("Converting to speech...")
+    text_to_speech(_echo(response), config.tts)
+
+def _echo(phrases):
+    """Log each phrase of the assistant's response as it streams in."""
+    for phrase in phrases:
+        log.info("Assistant: %s", phrase)
+        yield phrase
+
+async def run_assistant_pipeline(config):
+    """
+    Run the voice assistant continuously with every stage running concurrently
+    
+    Recording, transcription, ollama and speech are separate tasks connected
+    by queues, so the next utterance is transcribed while the last reply is
+    still being generated and spoken.
+    
+    Listening while the assistant talks needs a capture device with echo
+    cancellation (e.g. PulseAudio's module-echo-cancel), otherwise the
+    microphone hears the assistant. Unless config.audio.echo_cancelled is
+    set, capture pauses while a reply is in progress and anything recorded
+    over a reply is dropped. With it set, talking over the assistant stops
+    the reply in progress.
+    """
+    audio_queue = asyncio.Queue()
+    transcript_queue = asyncio.Queue()
+    reply = _Reply()
+    
+    # Speech picked up while the assistant is replying interrupts the reply,
+    # but only when the microphone can't hear the assistant itself
+    loop = asyncio.get_running_loop()
+    def on_speech():
+        loop.call_soon_threadsafe(reply.interrupt)
+    if not config.audio.echo_cancelled:
+        on_speech = None
+    
+    workers = [
+        asyncio.create_task(_record_worker(config.audio, config.ollama, audio_queue, reply, on_speech)),
+        asyncio.create_task(_transcribe_worker(config.whisper, audio_queue, transcript_queue)),
+        asyncio.create_task(_ollama_worker(config.ollama, transcript_queue, reply)),
+        asyncio.create_task(_speech_worker(config.tts, reply)),
+    ]
+    
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        stop_recording()
+        for worker in workers:
+            worker.cancel()
+        await close_async_session()
+
+class _Reply:
+    """The assistant's reply that is currently being generated and spoken."""
+    
+    def __init__(self):
+        self.phrases = asyncio.Queue()
+        self.task = None
+        self.speaking = False
+        # Bumped whenever a reply starts, so overlapping recordings can be spotted
+        self.turns = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+    
+    def busy(self):
+        """Return True while a reply is being generated or spoken."""
+        return self.task is not None or self.speaking or not self.phrases.empty()
+    
+    def start(self, task):
+        """Track the task generating a new reply."""
+        self.task = task
+        self.turns += 1
+        self._update()
+    
+    def finish(self):
+        """Mark reply generation as done; speaking may still be in progress."""
+        self.task.cancel()
+        self.task = None
+        self._update()
     
-    print("Converting to speech...")
-    text_to_speech(response, config["tts"])
+    def set_speaking(self, speaking):
+        """Record whether a phrase of the reply is being spoken."""
+        self.speaking = speaking
+        self._update()
+    
+    async def wait_idle(self):
+        """Wait until no reply is being generated or spoken."""
+        await self._idle.wait()
+    
+    def _update(self):
+        if self.busy():
+            self._idle.clear()
+        else:
+            self._idle.set()
+    
+    def interrupt(self):
+        """Stop the current reply so the user can talk over the assistant."""
+        if not self.busy():
+            return
+        
+        log.info("Interrupted.")
+        
+        # Cancelling the task closes the ollama stream, which stops generation
+        if self.task is not None:
+            self.task.cancel()
+        while not self.phrases.empty():
+            self.phrases.get_nowait()
+        stop_speech()
+        self._update()
+
+async def _record_worker(config, ollama_config, audio_queue, reply, on_speech):
+    """Record utterances and queue them for transcription."""
+    while True:
+        # Without echo cancellation the microphone would pick up the reply
+        if not config.echo_cancelled:
+            await reply.wait_idle()
+        turns = reply.turns
+        
+        # Check ollama is up while the user is speaking; the check travels
+        # with the utterance and is awaited just before calling ollama
+        ollama_ready = asyncio.create_task(check_ollama_async(ollama_config))
+        
+        log.info("\nListening... (press Ctrl+C to stop)")
+        audio = await record_audio_async(config, on_speech)
+        
+        # A reply that started mid-recording may have been recorded too
+        if not config.echo_cancelled and (reply.busy() or reply.turns != turns):
+            log.info("Ignoring speech recorded over the assistant.")
+            ollama_ready.cancel()
+            continue
+        
+        await audio_queue.put((audio, ollama_ready))
+
+async def _transcribe_worker(config, audio_queue, transcript_queue):
+    """Transcribe queued utterances and queue the text for ollama."""
+    while True:
+        audio, ollama_ready = await audio_queue.get()
+        log.info("Transcribing...")
+        transcript = await transcribe_audio_async(audio, config)
+        log.info("You said: %s", transcript)
+        
+        if not transcript.strip():
+            log.info("No speech detected. Please try again.")
+            continue
+        
+        await transcript_queue.put((transcript, ollama_ready))
+
+async def _ollama_worker(config, transcript_queue, reply):
+    """Stream ollama responses to queued transcripts into the reply's phrases."""
+    while True:
+        transcript, ollama_ready = await transcript_queue.get()
+        reply.start(asyncio.create_task(_generate_reply(transcript, ollama_ready, config, reply.phrases)))
+        try:
+            # Waiting doesn't raise if the reply itself gets interrupted
+            await asyncio.wait([reply.task])
+            
+            # Any other failure would otherwise leave the user in silence
+            if not reply.task.cancelled() and reply.task.exception() is not None:
+                error = reply.task.exception()
+                log.error("Error generating reply: %s", error, exc_info=error)
+                log.info("Assistant: %s", REQUEST_ERROR_REPLY)
+                await reply.phrases.put(REQUEST_ERROR_REPLY)
+        finally:
+            reply.finish()
+
+async def _generate_reply(transcript, ollama_ready, config, phrases):
+    """Stream a single ollama response into the phrase queue."""
+    if not await ollama_ready:
+        log.info("Assistant: %s", CONNECTION_ERROR_REPLY)
+        await phrases.put(CONNECTION_ERROR_REPLY)
+        return
+    
+    log.info("Processing with Ollama...")
+    async for phrase in process_with_ollama_async(transcript, config):
+        log.info("Assistant: %s", phrase)
+        await phrases.put(phrase)
+
+async def _speech_worker(config, reply):
+    """Speak the reply's phrases as they arrive."""
+    while True:
+        phrase = await reply.phrases.get()
+        reply.set_speaking(True)
+        try:
+            await text_to_speech_async(phrase, config)
+            # Speech returns once the audio is buffered, not once it's heard
+            while reply.phrases.empty() and (remaining := playback_remaining()) > 0:
+                await asyncio.sleep(min(remaining, PLAYBACK_POLL_S))
+        finally:
+            reply.set_speaking(False)
 
 def create_default_config(config_path):
     """Create a default configuration file."""
@@ -89,7 +336,12 @@ def create_default_config(config_path):
         },
         "ollama": {
             "model": "llama3",
-            "system_prompt": "You are a helpful voice assistant. Provide concise responses."
+            "system_prompt": "You are a helpful voice assistant. Provide concise responses.",
+            "cache": {
+                "enabled": False,
+                "path": "~/.cache/voice_assistant/semantic_cache",
+                "threshold": 0.92
+            }
         },
         "tts": {
             "engine": "piper",
@@ -98,7 +350,10 @@ def create_default_config(config_path):
         "audio": {
             "device": "default",
             "sample_rate": 16000,
-            "duration": 5
+            "duration": 5,
+            "silence_ms": 600,
+            "max_duration": 30,
+            "echo_cancelled": False
         }
     }
     
@@ -2,60 +2,245 @@
 Module for recording audio input
 """
 
-import os
+import asyncio
+import collections
+import logging
 import subprocess
-import tempfile
-import time
+import threading
 
-def record_audio(config):
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+# Length of each frame fed to the voice activity detector
+FRAME_MS = 20
+# Audio kept from just before speech starts so the first word isn't clipped
+PREROLL_MS = 200
+
+log = logging.getLogger("va")
+
+# Recorder process currently running, so shutdown can stop it
+_recorder = None
+_recorder_lock = threading.Lock()
+_stopped = threading.Event()
+
+def record_audio(config, on_speech=None):
     """
     Record audio from microphone
     
+    With webrtcvad installed, recording starts when speech is detected and
+    stops after a stretch of silence. Otherwise a fixed duration is recorded.
+    
     Args:
-        config: Audio recording configuration
+        config: Audio recording configuration (AudioCfg)
+        on_speech: Optional callback, run from the recording thread once the
+            user has been speaking for config.barge_in_ms
         
     Returns:
-        Path to the recorded audio file
+        Recorded mono audio as int16 samples
     """
-    duration = config.get("duration", 5)
-    sample_rate = config.get("sample_rate", 16000)
-    device = config.get("device", "default")
+    if webrtcvad is not None:
+        try:
+            return _record_until_silence(config, on_speech)
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            # arecord killed by a signal (e.g. Ctrl+C) means we are exiting
+            if _stopped.is_set() or getattr(e, "returncode", 0) < 0:
+                raise
+            log.warning("Voice activity recording failed (%s), recording a fixed duration instead.", e)
     
-    # Create a temporary file for the recording
-    output_file = os.path.join(tempfile.gettempdir(), f"recording_{int(time.time())}.wav")
+    duration = config.duration
+    sample_rate = config.sample_rate
+    device = config.device
     
     try:
-        # Try to use arecord (ALSA) for recording
+        # Try to use arecord (ALSA) for recording, streaming raw PCM to stdout
         cmd = [
             "arecord",
+            "-q",
             "-D", device,
+            "-t", "raw",
             "-f", "S16_LE",
             "-c", "1",
             "-r", str(sample_rate),
-            "-d", str(duration),
-            output_file
+            "-d", str(duration)
         ]
         
-        subprocess.run(cmd, check=True)
-        return output_file
+        return _pcm_to_samples(_run_recorder(cmd))
         
-    except (FileNotFoundError, subprocess.CalledProcessError):
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        if _stopped.is_set() or getattr(e, "returncode", 0) < 0:
+            raise
         # Fallback to sox if arecord fails
         try:
             cmd = [
                 "rec",
                 "-q",
-                output_file,
-                "rate", str(sample_rate),
-                "channels", "1",
+                "-t", "raw",
+                "-b", "16",
+                "-e", "signed-integer",
+                "-c", "1",
+                "-r", str(sample_rate),
+                "-",
                 "trim", "0", str(duration)
             ]
             
-            subprocess.run(cmd, check=True)
-            return output_file
+            return _pcm_to_samples(_run_recorder(cmd))
             
         except (FileNotFoundError, subprocess.CalledProcessError) as e:
-            print(f"Error recording audio: {e}")
-            print("Make sure you have either ALSA tools (arecord) or SoX (rec) installed.")
-            print("Install with: sudo apt-get install alsa-utils or sudo apt-get install sox")
-            raise
\ No newline at end of file
+            log.error(
+                "Error recording audio: %s\n"
+                "Make sure you have either ALSA tools (arecord) or SoX (rec) installed.\n"
+                "Install with: sudo apt-get install alsa-utils or sudo apt-get install sox",
+                e
+            )
+            raise
+
+async def record_audio_async(config, on_speech=None):
+    """
+    Record audio from microphone without blocking the event loop
+    
+    Args:
+        config: Audio recording configuration (AudioCfg)
+        on_speech: Optional callback, see record_audio()
+        
+    Returns:
+        Recorded mono audio as int16 samples
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, record_audio, config, on_speech)
+
+def stop_recording():
+    """
+    Stop the recording in progress and refuse to start new ones
+    
+    Called on shutdown so a recording thread doesn't keep the process alive.
+    """
+    _stopped.set()
+    with _recorder_lock:
+        if _recorder is not None and _recorder.poll() is None:
+            _recorder.terminate()
+
+def _start_recorder(cmd):
+    """
+    Start a recorder process streaming raw PCM to stdout
+    
+    Args:
+        cmd: Recorder command line
+        
+    Returns:
+        subprocess.Popen for the recorder
+        
+    Raises:
+        InterruptedError: If stop_recording() has been called
+    """
+    global _recorder
+    
+    with _recorder_lock:
+        if _stopped.is_set():
+            raise InterruptedError("Recording stopped")
+        _recorder = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        return _recorder
+
+def _run_recorder(cmd):
+    """
+    Run a fixed-duration recorder to completion
+    
+    Args:
+        cmd: Recorder command line
+        
+    Returns:
+        Raw PCM bytes
+        
+    Raises:
+        subprocess.CalledProcessError: If the recorder fails
+    """
+    process = _start_recorder(cmd)
+    pcm, _ = process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return pcm
+
+def _record_until_silence(config, on_speech=None):
+    """
+    Record a single utterance from the microphone using voice activity detection
+    
+    Args:
+        config: Audio recording configuration (AudioCfg)
+        on_speech: Optional callback run once sustained speech is detected
+        
+    Returns:
+        Recorded mono audio as int16 samples
+    """
+    sample_rate = config.sample_rate
+    silence_frames = config.silence_ms // FRAME_MS
+    max_frames = config.max_duration * 1000 // FRAME_MS
+    barge_in_frames = config.barge_in_ms // FRAME_MS
+    vad = webrtcvad.Vad(config.vad_aggressiveness)
+    
+    frame_bytes = sample_rate * FRAME_MS // 1000 * 2
+    preroll = collections.deque(maxlen=PREROLL_MS // FRAME_MS)
+    frames = []
+    unvoiced = 0
+    voiced_run = 0
+    
+    cmd = [
+        "arecord",
+        "-q",
+        "-D", config.device,
+        "-t", "raw",
+        "-f", "S16_LE",
+        "-c", "1",
+        "-r", str(sample_rate)
+    ]
+    
+    process = _start_recorder(cmd)
+    try:
+        while len(frames) < max_frames:
+            frame = process.stdout.read(frame_bytes)
+            if len(frame) < frame_bytes:
+                returncode = process.wait()
+                if returncode:
+                    raise subprocess.CalledProcessError(returncode, cmd)
+                break
+            
+            voiced = vad.is_speech(frame, sample_rate)
+            
+            # Wait for the first voiced frame before capturing
+            if not frames:
+                preroll.append(frame)
+                if voiced:
+                    frames.extend(preroll)
+                    voiced_run = 1
+                continue
+            
+            frames.append(frame)
+            unvoiced = 0 if voiced else unvoiced + 1
+            voiced_run = voiced_run + 1 if voiced else 0
+            if unvoiced >= silence_frames:
+                break
+            
+            # Let the caller know the user is really talking, not just a click
+            if on_speech is not None and barge_in_frames and voiced_run == barge_in_frames:
+                on_speech()
+                on_speech = None
+    finally:
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+    
+    return _pcm_to_samples(b"".join(frames))
+
+def _pcm_to_samples(pcm):
+    """
+    View raw 16-bit little-endian PCM as samples
+    
+    Args:
+        pcm: Raw PCM bytes
+        
+    Returns:
+        Numpy int16 array sharing memory with pcm
+    """
+    return np.frombuffer(pcm, dtype="<i2")
@@ -0,0 +1,112 @@
+"""
+Module for loading the voice assistant configuration
+"""
+
+import json
+from dataclasses import dataclass, field
+
+@dataclass(slots=True, frozen=True)
+class AudioCfg:
+    """Audio recording configuration"""
+    device: str = "default"
+    sample_rate: int = 16000
+    duration: int = 5
+    silence_ms: int = 600
+    max_duration: int = 30
+    vad_aggressiveness: int = 2
+    # Set when the capture device cancels the assistant's own voice, which
+    # lets continuous mode keep listening while a reply is playing
+    echo_cancelled: bool = False
+    # Sustained speech needed to interrupt the assistant; 0 disables barge-in.
+    # Only used when echo_cancelled is set
+    barge_in_ms: int = 200
+
+@dataclass(slots=True, frozen=True)
+class WhisperCfg:
+    """Whisper speech-to-text configuration"""
+    model: str = "base.en"
+    executable: str = "./whisper.cpp/main"
+    params: str = ""
+    language: str = "en"
+    # faster-whisper (CTranslate2) settings
+    device: str = "cpu"
+    compute_type: str = "int8"
+    # 0 uses half of the available cores
+    cpu_threads: int = 0
+    # Where downloaded models are stored; None uses the Hugging Face cache
+    download_root: str | None = None
+
+@dataclass(slots=True, frozen=True)
+class CacheCfg:
+    """Semantic response cache configuration"""
+    enabled: bool = False
+    path: str = "~/.cache/voice_assistant/semantic_cache"
+    threshold: float = 0.92
+
+@dataclass(slots=True, frozen=True)
+class OllamaCfg:
+    """Ollama configuration"""
+    model: str = "llama3"
+    system_prompt: str = "You are a helpful assistant."
+    host: str = "http://localhost:11434"
+    # How long ollama keeps the model loaded after each request
+    keep_alive: str = "30m"
+    cache: CacheCfg = field(default_factory=CacheCfg)
+
+@dataclass(slots=True, frozen=True)
+class TtsCfg:
+    """Text-to-speech configuration"""
+    engine: str = "piper"
+    # Defaults to the engine's own default voice when not set
+    voice: str | None = None
+    speed: int = 150
+    output_device: str = "default"
+
+@dataclass(slots=True, frozen=True)
+class AppCfg:
+    """Complete voice assistant configuration"""
+    audio: AudioCfg = field(default_factory=AudioCfg)
+    whisper: WhisperCfg = field(default_factory=WhisperCfg)
+    ollama: OllamaCfg = field(default_factory=OllamaCfg)
+    tts: TtsCfg = field(default_factory=TtsCfg)
+    # Streaming-mode settings used by the C++ assistant, kept as-is
+    streaming: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a configuration from parsed config.json contents
+
+        Args:
+            data: Dictionary loaded from config.json
+
+        Returns:
+            AppCfg instance
+
+        Raises:
+            TypeError: If the config contains unknown keys
+        """
+        data = dict(data)
+        ollama = dict(data.pop("ollama", {}))
+        cache = CacheCfg(**ollama.pop("cache", {}))
+
+        return cls(
+            audio=AudioCfg(**data.pop("audio", {})),
+            whisper=WhisperCfg(**data.pop("whisper", {})),
+            ollama=OllamaCfg(cache=cache, **ollama),
+            tts=TtsCfg(**data.pop("tts", {})),
+            **data
+        )
+
+def load_config(config_path):
+    """
+    Load the configuration file
+
+    Args:
+        config_path: Path to config.json
+
+    Returns:
+        AppCfg instance
+    """
+    with open(config_path, "r") as f:
+        return AppCfg.from_dict(json.load(f))
@@ -2,56 +2,369 @@
 Module for processing text with ollama
 """
 
+import asyncio
 import json
+import logging
+import re
 import subprocess
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+
+from modules.semantic_cache import get_semantic_cache
+
+# orjson decodes the one-object-per-token stream much faster than json
+try:
+    from orjson import dumps as _json_dumps, loads as _json_loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    _json_loads = json.loads
+
+# A phrase ends at sentence punctuation followed by whitespace, or at a newline
+PHRASE_END = re.compile(r"[.?!]+(?=\s)|\n")
+# Flush the phrase buffer once it grows past this many characters
+MAX_PHRASE_CHARS = 120
+# (connect, read) timeouts in seconds for ollama API calls
+REQUEST_TIMEOUT = (2, 120)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+log = logging.getLogger("va")
+
+CONNECTION_ERROR_REPLY = "Sorry, I'm having trouble connecting to my thinking module."
+REQUEST_ERROR_REPLY = "Sorry, I encountered an error while processing your request."
+
+# Shared session so the connection to ollama is kept alive between turns
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# Shared aiohttp session for the async pipeline, created inside its event loop
+_async_session = None
 
 def process_with_ollama(text, config):
     """
-    Process text with ollama
-    
+    Process text with ollama, streaming the response phrase by phrase
+
     Args:
         text: Input text to process
-        config: Ollama configuration
-    
+        config: Ollama configuration (OllamaCfg)
+
+    Yields:
+        Phrases of the response from ollama, as soon as each one is complete
+    """
+    host = config.host
+
+    # Reuse a cached response to a similar question if there is one
+    cache = get_semantic_cache(config.cache)
+    if cache is not None:
+        try:
+            key = cache.embed(text)
+        except Exception as e:
+            log.warning("Could not embed transcript for the semantic cache: %s", e)
+            cache = None
+    if cache is not None:
+        cached = cache.lookup(key, config.model, config.system_prompt)
+        if cached is not None:
+            yield from _cached_phrases(cached)
+            return
+
+    # Make the API call to ollama
+    try:
+        payload = _build_payload(text, config)
+
+        with _SESSION.post(
+            f"{host}/api/generate",
+            data=_json_dumps(payload),
+            headers=JSON_HEADERS,
+            stream=True,
+            timeout=REQUEST_TIMEOUT
+        ) as response:
+            if response.status_code != 200:
+                log.error("Error from ollama API: %s\n%s", response.status_code, response.text)
+                yield REQUEST_ERROR_REPLY
+                return
+
+            reply = []
+            buffer = ""
+            done = False
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = _json_loads(line)
+                if chunk.get("error"):
+                    # Generation failed part way, so what came so far is incomplete
+                    log.error("Error from ollama API: %s", chunk["error"])
+                    yield REQUEST_ERROR_REPLY
+                    return
+                buffer += chunk.get("response", "")
+                done = chunk.get("done", False)
+                phrases, buffer = _split_phrases(buffer)
+                reply.extend(phrases)
+                yield from phrases
+
+            if buffer.strip():
+                reply.append(buffer.strip())
+                yield buffer.strip()
+
+        # Only a reply that ollama finished is worth replaying
+        if cache is not None and done and reply:
+            cache.insert(key, config.model, config.system_prompt, text, " ".join(reply))
+
+    except requests.exceptions.ConnectionError:
+        log.error("Ollama server not running. Please start ollama service.")
+        yield CONNECTION_ERROR_REPLY
+    except requests.exceptions.Timeout:
+        log.error("Ollama server not responding. Make sure it's running.")
+        yield CONNECTION_ERROR_REPLY
+    except Exception as e:
+        log.error("Error calling ollama: %s", e)
+        yield REQUEST_ERROR_REPLY
+
+async def process_with_ollama_async(text, config):
+    """
+    Process text with ollama without blocking the event loop
+
+    Args:
+        text: Input text to process
+        config: Ollama configuration (OllamaCfg)
+
+    Yields:
+        Phrases of the response from ollama, as soon as each one is complete
+    """
+    host = config.host
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=REQUEST_TIMEOUT[0],
+        sock_read=REQUEST_TIMEOUT[1]
+    )
+
+    loop = asyncio.get_running_loop()
+
+    # Reuse a cached response to a similar question if there is one; opening
+    # the cache loads the embedding model, so keep that off the event loop
+    cache = await loop.run_in_executor(None, get_semantic_cache, config.cache)
+    if cache is not None:
+        try:
+            key = await loop.run_in_executor(None, cache.embed, text)
+        except Exception as e:
+            log.warning("Could not embed transcript for the semantic cache: %s", e)
+            cache = None
+    if cache is not None:
+        cached = cache.lookup(key, config.model, config.system_prompt)
+        if cached is not None:
+            for phrase in _cached_phrases(cached):
+                yield phrase
+            return
+
+    try:
+        payload = _build_payload(text, config)
+
+        async with _get_async_session().post(
+            f"{host}/api/generate",
+            data=_json_dumps(payload),
+            headers=JSON_HEADERS,
+            timeout=timeout
+        ) as response:
+            if response.status != 200:
+                log.error("Error from ollama API: %s\n%s", response.status, await response.text())
+                yield REQUEST_ERROR_REPLY
+                return
+
+            reply = []
+            buffer = ""
+            done = False
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = _json_loads(line)
+                if chunk.get("error"):
+                    # Generation failed part way, so what came so far is incomplete
+                    log.error("Error from ollama API: %s", chunk["error"])
+                    yield REQUEST_ERROR_REPLY
+                    return
+                buffer += chunk.get("response", "")
+                done = chunk.get("done", False)
+                phrases, buffer = _split_phrases(buffer)
+                reply.extend(phrases)
+                for phrase in phrases:
+                    yield phrase
+
+            if buffer.strip():
+                reply.append(buffer.strip())
+                yield buffer.strip()
+
+        # Only a reply that ollama finished is worth replaying
+        if cache is not None and done and reply:
+            await loop.run_in_executor(
+                None, cache.insert, key, config.model, config.system_prompt, text, " ".join(reply)
+            )
+
+    except aiohttp.ClientConnectionError:
+        log.error("Ollama server not running. Please start ollama service.")
+        yield CONNECTION_ERROR_REPLY
+    except asyncio.TimeoutError:
+        log.error("Ollama server not responding. Make sure it's running.")
+        yield CONNECTION_ERROR_REPLY
+    except Exception as e:
+        log.error("Error calling ollama: %s", e)
+        yield REQUEST_ERROR_REPLY
+
+def check_ollama(config):
+    """
+    Check that the ollama server is up
+
+    Args:
+        config: Ollama configuration (OllamaCfg)
+
     Returns:
-        Response from ollama
+        True if ollama answered, False otherwise
     """
-    model = config["model"]
-    system_prompt = config.get("system_prompt", "You are a helpful assistant.")
-    
-    # Check if ollama is running
     try:
-        response = requests.get("http://localhost:11434/api/tags")
+        response = _SESSION.get(f"{config.host}/api/tags", timeout=REQUEST_TIMEOUT[0])
         if response.status_code != 200:
-            print("Ollama server not responding. Make sure it's running.")
-            return "Sorry, I'm having trouble connecting to my thinking module."
+            log.error("Ollama server not responding. Make sure it's running.")
+            return False
+        return True
     except requests.exceptions.ConnectionError:
-        print("Ollama server not running. Please start ollama service.")
-        return "Sorry, I'm having trouble connecting to my thinking module."
-    
-    # Make the API call to ollama
+        log.error("Ollama server not running. Please start ollama service.")
+        return False
+    except requests.exceptions.Timeout:
+        log.error("Ollama server not responding. Make sure it's running.")
+        return False
+    except requests.exceptions.RequestException as e:
+        log.error("Could not reach ollama at %s: %s", config.host, e)
+        return False
+
+async def check_ollama_async(config):
+    """
+    Check that the ollama server is up without blocking the event loop
+
+    Args:
+        config: Ollama configuration (OllamaCfg)
+
+    Returns:
+        True if ollama answered, False otherwise
+    """
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT[0])
+
+    try:
+        async with _get_async_session().get(f"{config.host}/api/tags", timeout=timeout) as response:
+            if response.status != 200:
+                log.error("Ollama server not responding. Make sure it's running.")
+                return False
+            return True
+    except aiohttp.ClientConnectionError:
+        log.error("Ollama server not running. Please start ollama service.")
+        return False
+    except asyncio.TimeoutError:
+        log.error("Ollama server not responding. Make sure it's running.")
+        return False
+    except aiohttp.ClientError as e:
+        log.error("Could not reach ollama at %s: %s", config.host, e)
+        return False
+
+def warm_up_ollama(config):
+    """
+    Load the ollama model so the first reply doesn't pay for it
+
+    Args:
+        config: Ollama configuration (OllamaCfg)
+    """
+    # A generate request without a prompt just loads the model
+    payload = {"model": config.model, "keep_alive": config.keep_alive}
+
     try:
-        payload = {
-            "model": model,
-            "prompt": text,
-            "system": system_prompt,
-            "stream": False
-        }
-        
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json=payload
+        response = _SESSION.post(
+            f"{config.host}/api/generate",
+            data=_json_dumps(payload),
+            headers=JSON_HEADERS,
+            timeout=REQUEST_TIMEOUT
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get("response", "")
-        else:
-            print(f"Error from ollama API: {response.status_code}")
-            print(response.text)
-            return "Sorry, I encountered an error while processing your request."
-    
-    except Exception as e:
-        print(f"Error calling ollama: {e}")
-        return "Sorry, I encountered an error while processing your request."
\ No newline at end of file
+        if response.status_code != 200:
+            log.error("Error loading ollama model: %s\n%s", response.status_code, response.text)
+    except requests.exceptions.RequestException as e:
+        log.warning("Could not load ollama model: %s", e)
+
+async def close_async_session():
+    """Close the shared aiohttp session, if one was opened."""
+    global _async_session
+
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+
+def _get_async_session():
+    """
+    Get the shared aiohttp session, creating it on first use
+
+    Returns:
+        aiohttp.ClientSession bound to the running event loop
+    """
+    global _async_session
+
+    if _async_session is None or _async_session.closed:
+        _async_session = aiohttp.ClientSession()
+    return _async_session
+
+def _build_payload(text, config):
+    """
+    Build a streaming generate request for ollama
+
+    Args:
+        text: Input text to process
+        config: Ollama configuration (OllamaCfg)
+
+    Returns:
+        Request payload for /api/generate
+    """
+    return {
+        "model": config.model,
+        "prompt": text,
+        "system": config.system_prompt,
+        "stream": True,
+        # Every request resets how long ollama keeps the model loaded
+        "keep_alive": config.keep_alive
+    }
+
+def _split_phrases(buffer):
+    """
+    Split complete phrases off the front of a streamed text buffer
+
+    Args:
+        buffer: Text received so far that has not been spoken yet
+
+    Returns:
+        Tuple of (list of complete phrases, remaining partial text)
+    """
+    phrases = []
+    start = 0
+    for match in PHRASE_END.finditer(buffer):
+        phrase = buffer[start:match.end()].strip()
+        if phrase:
+            phrases.append(phrase)
+        start = match.end()
+
+    rest = buffer[start:]
+    if len(rest) > MAX_PHRASE_CHARS:
+        # No sentence boundary yet, so break on the last word boundary
+        cut = rest.rfind(" ", 0, MAX_PHRASE_CHARS)
+        if cut <= 0:
+            cut = MAX_PHRASE_CHARS
+        phrases.append(rest[:cut].strip())
+        rest = rest[cut:]
+
+    return phrases, rest
+
+def _cached_phrases(response):
+    """
+    Split a complete cached response into phrases for speaking
+
+    Args:
+        response: Full response text
+
+    Returns:
+        List of phrases
+    """
+    phrases, rest = _split_phrases(response)
+    if rest.strip():
+        phrases.append(rest.strip())
+    return phrases
@@ -0,0 +1,175 @@
+"""
+Module for caching ollama responses by transcript similarity
+"""
+
+import importlib.util
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+log = logging.getLogger("va")
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+# Minimum cosine similarity for a cached response to be reused
+DEFAULT_THRESHOLD = 0.92
+# Number of key rows the memmap grows by when it fills up
+KEY_BLOCK_ROWS = 1024
+
+# Open caches, keyed by directory; None marks a cache that failed to open
+_caches = {}
+_caches_lock = threading.Lock()
+
+class SemanticCache:
+    """
+    Ollama responses keyed by the embedding of the transcript that produced them
+
+    Normalized embeddings are stored one row per entry in a numpy memmap and
+    the responses in a SQLite table, where row N of the memmap belongs to the
+    Nth response. Each response is stored with the model and system prompt
+    that produced it and only matches lookups made with the same ones.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD):
+        """
+        Open (or create) a cache directory
+
+        Args:
+            path: Directory holding the cache files
+            threshold: Minimum cosine similarity for a hit
+        """
+        # Importing sentence-transformers pulls in torch, so only do it when used
+        from sentence_transformers import SentenceTransformer
+
+        os.makedirs(path, exist_ok=True)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._model = SentenceTransformer(EMBEDDING_MODEL)
+
+        self._db = sqlite3.connect(os.path.join(path, "responses.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(id INTEGER PRIMARY KEY, model TEXT NOT NULL, system_prompt TEXT NOT NULL, "
+            "query TEXT NOT NULL, response TEXT NOT NULL)"
+        )
+        self._responses = []
+        # Rows of the memmap for each (model, system prompt)
+        self._rows = {}
+        for model, system_prompt, response in self._db.execute(
+            "SELECT model, system_prompt, response FROM responses ORDER BY id"
+        ):
+            self._rows.setdefault((model, system_prompt), []).append(len(self._responses))
+            self._responses.append(response)
+
+        self._keys_path = os.path.join(path, "keys.f32")
+        self._keys = None
+        self._map_keys(len(self._responses))
+
+    def embed(self, text):
+        """
+        Embed a transcript
+
+        Args:
+            text: Transcript to embed
+
+        Returns:
+            Unit-length float32 vector
+        """
+        with self._lock:
+            return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def lookup(self, key, model, system_prompt):
+        """
+        Find the cached response closest to an embedded transcript
+
+        Args:
+            key: Embedding returned by embed()
+            model: Ollama model the response must come from
+            system_prompt: System prompt the response must come from
+
+        Returns:
+            The cached response, or None if nothing is similar enough
+        """
+        with self._lock:
+            rows = self._rows.get((model, system_prompt))
+            if not rows:
+                return None
+
+            scores = self._keys[rows] @ key
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self._responses[rows[best]]
+            return None
+
+    def insert(self, key, model, system_prompt, text, response):
+        """
+        Add a response to the cache
+
+        Args:
+            key: Embedding returned by embed()
+            model: Ollama model that produced the response
+            system_prompt: System prompt the response was produced with
+            text: Transcript the response answers
+            response: Response from ollama
+        """
+        with self._lock:
+            row = len(self._responses)
+            self._map_keys(row + 1)
+            self._keys[row] = key
+            self._keys.flush()
+
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO responses (model, system_prompt, query, response) VALUES (?, ?, ?, ?)",
+                    (model, system_prompt, text, response)
+                )
+            self._rows.setdefault((model, system_prompt), []).append(row)
+            self._responses.append(response)
+
+    def _map_keys(self, rows):
+        """
+        Map the key file, growing it if it holds fewer than the given rows
+
+        Args:
+            rows: Number of key rows that must fit
+        """
+        if self._keys is not None and self._keys.shape[0] >= rows:
+            return
+        # An empty file can't be mapped, so always keep at least one row
+        rows = max(rows, 1)
+
+        row_bytes = EMBEDDING_DIM * np.dtype(np.float32).itemsize
+        with open(self._keys_path, "ab") as f:
+            if f.tell() < rows * row_bytes:
+                blocks = rows // KEY_BLOCK_ROWS + 1
+                f.truncate(blocks * KEY_BLOCK_ROWS * row_bytes)
+
+        capacity = os.path.getsize(self._keys_path) // row_bytes
+        self._keys = np.memmap(self._keys_path, dtype=np.float32, mode="r+", shape=(capacity, EMBEDDING_DIM))
+
+def get_semantic_cache(config):
+    """
+    Get the semantic cache described by a cache configuration
+
+    Args:
+        config: Cache configuration (CacheCfg)
+
+    Returns:
+        SemanticCache, or None if caching is disabled or unavailable
+    """
+    if not config.enabled or importlib.util.find_spec("sentence_transformers") is None:
+        return None
+
+    path = os.path.expanduser(config.path)
+    with _caches_lock:
+        if path not in _caches:
+            try:
+                _caches[path] = SemanticCache(path, config.threshold)
+            except Exception as e:
+                # e.g. the embedding model can't be downloaded; don't retry every turn
+                log.warning("Semantic cache disabled, could not open it: %s", e)
+                _caches[path] = None
+        return _caches[path]
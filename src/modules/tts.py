@@ -2,68 +2,363 @@
 Module for text-to-speech synthesis
 """
 
+import asyncio
+import json
+import logging
 import os
+import queue
 import subprocess
 import tempfile
+import threading
+import time
+import wave
 from pathlib import Path
 
+try:
+    from piper.voice import PiperVoice
+except ImportError:
+    PiperVoice = None
+
+log = logging.getLogger("va")
+
+DEFAULT_PIPER_VOICE = "en_US-amy-medium"
+# Default output rate of piper voices, used if the voice config can't be read
+PIPER_SAMPLE_RATE = 22050
+# Audio is moved from piper to the player in pipe-page-sized chunks
+PIPE_CHUNK_BYTES = 4096
+
+# Loaded piper voices, keyed by voice name, so switching voices is free
+_PIPER_POOL = {}
+_raw_player = None
+_raw_player_rate = None
+_raw_player_missing = False
+# When audio written to the raw player will have finished playing (monotonic)
+_playback_end = 0.0
+
+# Guards the process currently speaking so stop_speech() can end it
+_speech_lock = threading.Lock()
+_current_process = None
+# Incremented by stop_speech() so in-flight speech can tell it was stopped
+_interruptions = 0
+
 def text_to_speech(text, config):
     """
     Convert text to speech using the configured TTS engine
     
+    Args:
+        text: Text to convert to speech, or an iterable of phrases which are
+            spoken by a worker thread as soon as each one arrives
+        config: TTS configuration (TtsCfg)
+    """
+    if isinstance(text, str):
+        _speak(text, config)
+        return
+    
+    phrases = queue.Queue()
+    worker = threading.Thread(target=_tts_worker, args=(phrases, config), daemon=True)
+    worker.start()
+    
+    try:
+        for phrase in text:
+            phrases.put(phrase)
+    finally:
+        # Signal the worker that no more phrases are coming
+        phrases.put(None)
+        worker.join()
+
+async def text_to_speech_async(text, config):
+    """
+    Convert text to speech without blocking the event loop
+    
+    Args:
+        text: Text to convert to speech
+        config: TTS configuration (TtsCfg)
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, text_to_speech, text, config)
+
+def warm_up_tts(config):
+    """
+    Start the TTS engine ahead of time so the first reply doesn't pay for it
+    
+    Args:
+        config: TTS configuration (TtsCfg)
+    """
+    if config.engine != "piper":
+        return
+    
+    try:
+        server = get_piper(config.voice or DEFAULT_PIPER_VOICE)
+        # Synthesize (without playing) a word to get ONNX Runtime warmed up
+        server.synth("Ready.")
+        _get_raw_player(server.sample_rate)
+    except (OSError, RuntimeError) as e:
+        log.warning("Could not start piper: %s", e)
+
+def stop_speech():
+    """
+    Stop any speech that is currently playing
+    
+    Used to let the user interrupt the assistant. Audio already queued in
+    the persistent player is discarded along with the player itself.
+    """
+    global _interruptions, _playback_end
+    
+    with _speech_lock:
+        _interruptions += 1
+        _playback_end = 0.0
+        if _current_process is not None and _current_process.poll() is None:
+            _current_process.terminate()
+        if _raw_player is not None and _raw_player.poll() is None:
+            _raw_player.kill()
+
+def playback_remaining():
+    """
+    Get how much audio is still queued in the persistent player
+    
+    Writes to the player return as soon as the audio is buffered, well
+    before it has been heard, so this tracks the audio actually written.
+    
+    Returns:
+        Seconds until the raw player falls silent
+    """
+    return max(0.0, _playback_end - time.monotonic())
+
+def _tts_worker(phrases, config):
+    """
+    Speak phrases from a queue until a None sentinel is received
+    
+    Args:
+        phrases: Queue of phrases to speak
+        config: TTS configuration (TtsCfg)
+    """
+    while True:
+        phrase = phrases.get()
+        if phrase is None:
+            return
+        _speak(phrase, config)
+
+def _speak(text, config):
+    """
+    Speak a single piece of text with the configured TTS engine
+    
     Args:
         text: Text to convert to speech
-        config: TTS configuration
+        config: TTS configuration (TtsCfg)
     """
-    engine = config.get("engine", "piper")
+    engine = config.engine
     
     if engine == "piper":
         _tts_piper(text, config)
     elif engine == "espeak":
         _tts_espeak(text, config)
     else:
-        print(f"Unsupported TTS engine: {engine}")
-        print("Supported engines: piper, espeak")
+        log.error("Unsupported TTS engine: %s\nSupported engines: piper, espeak", engine)
 
-def _tts_piper(text, config):
+class PiperServer:
     """
-    Use piper for text-to-speech
+    A piper voice that stays loaded between utterances
+    
+    With the piper-tts Python package installed the voice model is loaded
+    in-process. Otherwise a persistent piper process is run with
+    --output_dir: it reads one utterance per line on stdin and prints the
+    path of each finished WAV file on stdout, which marks where the
+    utterance's audio ends.
+    """
+    
+    def __init__(self, voice):
+        """
+        Load the given voice
+        
+        Args:
+            voice: Name of a voice under piper-voices/
+            
+        Raises:
+            RuntimeError: If the voice model isn't installed
+        """
+        self.voice = voice
+        self.model_path = os.path.abspath(f"piper-voices/{voice}/model.onnx")
+        if not os.path.exists(self.model_path):
+            raise RuntimeError(f"Piper voice not found: {self.model_path}")
+        
+        self._lock = threading.Lock()
+        self.process = None
+        if PiperVoice is not None:
+            self._voice = PiperVoice.load(self.model_path)
+            self.sample_rate = self._voice.config.sample_rate
+            return
+        
+        self._voice = None
+        self.sample_rate = _piper_sample_rate(self.model_path)
+        self._output_dir = tempfile.mkdtemp(prefix="piper-")
+        self.process = subprocess.Popen(
+            ["piper", "--model", self.model_path, "--output_dir", self._output_dir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    
+    def synth(self, text):
+        """
+        Synthesize text to speech
+        
+        Args:
+            text: Text to synthesize
+            
+        Returns:
+            Raw 16-bit mono PCM audio at self.sample_rate
+        """
+        return b"".join(self.stream(text))
+    
+    def stream(self, text):
+        """
+        Synthesize text to speech, yielding audio as piper produces it
+        
+        The generator can be closed early to abandon the utterance.
+        
+        Args:
+            text: Text to synthesize
+            
+        Yields:
+            Chunks of raw 16-bit mono PCM audio at self.sample_rate
+        """
+        line = " ".join(text.split())
+        if not line:
+            return
+        
+        if self._voice is None:
+            yield from self._stream_executable(line)
+            return
+        
+        # Piper synthesizes one sentence at a time; only the synthesis itself
+        # is locked so an abandoned generator can't block other callers
+        sentences = self._synthesize(line)
+        while True:
+            with self._lock:
+                audio = next(sentences, None)
+            if audio is None:
+                return
+            
+            # Hand audio on in small chunks so playback can stop promptly
+            view = memoryview(audio)
+            for start in range(0, len(view), PIPE_CHUNK_BYTES):
+                yield view[start:start + PIPE_CHUNK_BYTES]
+    
+    def _synthesize(self, line):
+        """
+        Synthesize a line in-process
+        
+        Args:
+            line: Text to synthesize
+            
+        Returns:
+            Iterator of raw PCM bytes, one item per sentence
+        """
+        # piper-tts 1.3 replaced synthesize_stream_raw() with audio chunks
+        if hasattr(self._voice, "synthesize_stream_raw"):
+            return self._voice.synthesize_stream_raw(line)
+        return (chunk.audio_int16_bytes for chunk in self._voice.synthesize(line))
+    
+    def _stream_executable(self, line):
+        """
+        Synthesize a line with the persistent piper process
+        
+        Args:
+            line: Text to synthesize
+            
+        Yields:
+            Chunks of raw PCM audio for the line
+        """
+        with self._lock:
+            self.process.stdin.write((line + "\n").encode("utf-8"))
+            self.process.stdin.flush()
+            
+            wav_path = self.process.stdout.readline().decode("utf-8").strip()
+            if not wav_path:
+                raise RuntimeError(f"piper exited with code {self.process.wait()}")
+            
+            try:
+                with wave.open(wav_path, "rb") as wav:
+                    audio = wav.readframes(wav.getnframes())
+            finally:
+                os.unlink(wav_path)
+        
+        view = memoryview(audio)
+        for start in range(0, len(view), PIPE_CHUNK_BYTES):
+            yield view[start:start + PIPE_CHUNK_BYTES]
+    
+    def alive(self):
+        """Return True if the voice is loaded and its piper process, if any, is running."""
+        return self.process is None or self.process.poll() is None
+
+def _piper_sample_rate(model_path):
+    """
+    Read the output sample rate from a piper voice's JSON config
     
     Args:
-        text: Text to convert to speech
-        config: TTS configuration
+        model_path: Path to the piper voice model (.onnx)
+        
+    Returns:
+        Sample rate in Hz
+    """
+    try:
+        with open(f"{model_path}.json", "r") as f:
+            return json.load(f)["audio"]["sample_rate"]
+    except (OSError, KeyError, ValueError):
+        return PIPER_SAMPLE_RATE
+
+def get_piper(voice):
     """
-    voice = config.get("voice", "en_US-amy-medium")
+    Get the piper server for a voice, loading it if needed
     
-    with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as text_file:
-        text_file.write(text.encode('utf-8'))
-        text_file_path = text_file.name
+    Each voice stays loaded, so switching between voices doesn't reload a
+    model. A server whose piper process has exited is replaced.
     
-    output_file = os.path.join(tempfile.gettempdir(), "tts_output.wav")
+    Args:
+        voice: Name of a voice under piper-voices/
+        
+    Returns:
+        PiperServer running the requested voice
+    """
+    server = _PIPER_POOL.get(voice)
+    if server is None or not server.alive():
+        server = PiperServer(voice)
+        _PIPER_POOL[voice] = server
+    return server
+
+def _tts_piper(text, config):
+    """
+    Use piper for text-to-speech
     
+    Args:
+        text: Text to convert to speech
+        config: TTS configuration (TtsCfg)
+    """
     try:
-        cmd = [
-            "piper",
-            "--model", f"piper-voices/{voice}/model.onnx",
-            "--output_file", output_file,
-            "--text_file", text_file_path
-        ]
+        interruptions = _interruptions
+        server = get_piper(config.voice or DEFAULT_PIPER_VOICE)
+        player = _get_raw_player(server.sample_rate)
         
-        subprocess.run(cmd, check=True)
+        if player is None:
+            # Without aplay, go through a WAV file and any available player
+            _play_pcm_file(server.synth(text), server.sample_rate)
+            return
         
-        # Play the audio
-        play_audio(output_file)
+        # Play the audio while piper is still synthesizing the rest
+        for chunk in server.stream(text):
+            if _interruptions != interruptions:
+                break
+            try:
+                _write_to_player(player, chunk, server.sample_rate)
+            except BrokenPipeError:
+                if _interruptions == interruptions:
+                    log.error("Audio player exited unexpectedly.")
+                break
         
     except FileNotFoundError:
-        print("Piper not found. Make sure it's installed.")
-        print("Install with: pip install piper-tts")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running piper: {e}")
-    finally:
-        # Clean up
-        os.unlink(text_file_path)
-        if os.path.exists(output_file):
-            os.unlink(output_file)
+        log.error("Piper not found. Make sure it's installed.\nInstall with: pip install piper-tts")
+    except (OSError, RuntimeError) as e:
+        log.error("Error running piper: %s", e)
 
 def _tts_espeak(text, config):
     """
@@ -71,19 +366,18 @@ def _tts_espeak(text, config):
     
     Args:
         text: Text to convert to speech
-        config: TTS configuration
+        config: TTS configuration (TtsCfg)
     """
-    voice = config.get("voice", "en")
-    speed = config.get("speed", 150)
+    voice = config.voice or "en"
+    speed = config.speed
     
     try:
         cmd = ["espeak", "-v", voice, "-s", str(speed), text]
-        subprocess.run(cmd, check=True)
+        _run_interruptible(cmd)
     except FileNotFoundError:
-        print("espeak not found. Make sure it's installed.")
-        print("Install with: sudo apt-get install espeak")
+        log.error("espeak not found. Make sure it's installed.\nInstall with: sudo apt-get install espeak")
     except subprocess.CalledProcessError as e:
-        print(f"Error running espeak: {e}")
+        log.error("Error running espeak: %s", e)
 
 def play_audio(audio_file):
     """
@@ -101,9 +395,106 @@ def play_audio(audio_file):
     for player, args in players:
         try:
             cmd = [player] + args + [audio_file]
-            subprocess.run(cmd, check=True)
+            _run_interruptible(cmd)
             return
         except (FileNotFoundError, subprocess.CalledProcessError):
             continue
     
-    print("No suitable audio player found. Install aplay, paplay, or sox.")
\ No newline at end of file
+    log.error("No suitable audio player found. Install aplay, paplay, or sox.")
+
+def _run_interruptible(cmd):
+    """
+    Run a speech or playback command that stop_speech() can terminate
+    
+    Args:
+        cmd: Command to run
+        
+    Raises:
+        subprocess.CalledProcessError: If the command fails on its own
+    """
+    global _current_process
+    
+    with _speech_lock:
+        interruptions = _interruptions
+        process = subprocess.Popen(cmd)
+        _current_process = process
+    
+    returncode = process.wait()
+    
+    with _speech_lock:
+        _current_process = None
+        interrupted = _interruptions != interruptions
+    
+    if returncode and not interrupted:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+def _write_to_player(player, audio, sample_rate):
+    """
+    Write raw PCM to the persistent player and extend the playback deadline
+    
+    Args:
+        player: aplay Popen returned by _get_raw_player()
+        audio: Raw 16-bit mono PCM audio bytes
+        sample_rate: Sample rate of the audio in Hz
+    """
+    global _playback_end
+    
+    player.stdin.write(audio)
+    with _speech_lock:
+        _playback_end = max(_playback_end, time.monotonic()) + len(audio) / (sample_rate * 2)
+
+def _get_raw_player(sample_rate):
+    """
+    Get the persistent aplay process for raw PCM, starting it if needed
+    
+    Args:
+        sample_rate: Sample rate of the audio in Hz
+        
+    Returns:
+        aplay Popen reading PCM from stdin, or None if aplay isn't installed
+    """
+    global _raw_player, _raw_player_rate, _raw_player_missing
+    
+    if _raw_player_missing:
+        return None
+    
+    if _raw_player is None or _raw_player.poll() is not None or _raw_player_rate != sample_rate:
+        if _raw_player is not None and _raw_player.poll() is None:
+            _raw_player.stdin.close()
+        try:
+            _raw_player = subprocess.Popen(
+                ["aplay", "-q", "-r", str(sample_rate), "-f", "S16_LE", "-c", "1"],
+                stdin=subprocess.PIPE,
+                bufsize=0
+            )
+            _raw_player_rate = sample_rate
+        except FileNotFoundError:
+            _raw_player = None
+            _raw_player_missing = True
+            return None
+    
+    return _raw_player
+
+def _play_pcm_file(audio, sample_rate):
+    """
+    Play raw 16-bit mono PCM by writing it to a WAV file
+    
+    Args:
+        audio: Raw PCM audio bytes
+        sample_rate: Sample rate of the audio in Hz
+    """
+    if not audio:
+        return
+    
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as wav_file:
+        output_file = wav_file.name
+    
+    try:
+        with wave.open(output_file, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(audio)
+        play_audio(output_file)
+    finally:
+        os.unlink(output_file)
@@ -1,24 +1,188 @@
 """
-Module for speech-to-text using whisper.cpp
+Module for speech-to-text using faster-whisper, falling back to whisper.cpp
 """
 
+import asyncio
+import logging
+import mmap
 import os
 import subprocess
 import tempfile
+import wave
 from pathlib import Path
 
-def transcribe_audio(audio_file, config):
+import numpy as np
+
+try:
+    from faster_whisper import WhisperModel
+    from faster_whisper.utils import download_model
+except ImportError:
+    WhisperModel = None
+
+log = logging.getLogger("va")
+
+# Whisper models expect 16 kHz mono input
+SAMPLE_RATE = 16000
+
+# Loaded faster-whisper models, keyed by model name
+_models = {}
+# Read-only mappings of model weight files, kept open so their pages stay cached
+_model_maps = {}
+
+def transcribe_audio(audio, config):
+    """
+    Transcribe audio, in-process with faster-whisper when it is installed
+    
+    Args:
+        audio: 16 kHz mono int16 samples
+        config: Whisper configuration (WhisperCfg)
+        
+    Returns:
+        Transcribed text
     """
-    Transcribe audio using whisper.cpp
+    if WhisperModel is not None:
+        return _transcribe_faster_whisper(audio, config)
+    
+    # whisper.cpp only reads from files, so hand it the samples as a WAV
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as wav_file:
+        audio_file = wav_file.name
+    try:
+        _write_wav(audio, audio_file)
+        return _transcribe_whisper_cpp(audio_file, config)
+    finally:
+        os.remove(audio_file)
+
+async def transcribe_audio_async(audio, config):
+    """
+    Transcribe audio without blocking the event loop
+    
+    Args:
+        audio: 16 kHz mono int16 samples
+        config: Whisper configuration (WhisperCfg)
+        
+    Returns:
+        Transcribed text
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, transcribe_audio, audio, config)
+
+def warm_up_whisper(config):
+    """
+    Load the whisper model and run it once so the first turn doesn't pay for it
+    
+    Args:
+        config: Whisper configuration (WhisperCfg)
+    """
+    if WhisperModel is None:
+        return
+    
+    try:
+        model = _get_model(config)
+        # Segments are generated lazily, so consume them to run the model;
+        # the VAD filter is off because it would skip silence entirely
+        segments, _ = model.transcribe(
+            np.zeros(SAMPLE_RATE, dtype=np.float32),
+            language=config.language,
+            beam_size=1
+        )
+        for _ in segments:
+            pass
+    except Exception as e:
+        log.warning("Could not load whisper model: %s", e)
+
+def _get_model(config):
+    """
+    Get a faster-whisper model, loading it on first use
+    
+    Args:
+        config: Whisper configuration (WhisperCfg)
+        
+    Returns:
+        WhisperModel kept resident for later calls
+    """
+    if config.model not in _models:
+        if os.path.isdir(config.model):
+            model_path = config.model
+        else:
+            model_path = download_model(config.model, cache_dir=config.download_root)
+        
+        for weights in Path(model_path).glob("*.bin"):
+            _map_model_file(weights)
+        
+        _models[config.model] = WhisperModel(
+            model_path,
+            device=config.device,
+            compute_type=config.compute_type,
+            cpu_threads=config.cpu_threads or max(1, (os.cpu_count() or 2) // 2)
+        )
+    return _models[config.model]
+
+def _map_model_file(path):
+    """
+    Map a model file into memory and have the kernel read it in ahead of use
+    
+    The mapping is kept for the life of the process, so the weights stay in
+    the page cache and are shared with any other process loading them.
+    
+    Args:
+        path: Path to the model file
+    """
+    path = str(path)
+    if path in _model_maps:
+        return
+    
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        mapping = mmap.mmap(
+            fd, 0,
+            flags=mmap.MAP_PRIVATE | getattr(mmap, "MAP_POPULATE", 0),
+            prot=mmap.PROT_READ
+        )
+    finally:
+        os.close(fd)
+    
+    for advice in ("MADV_SEQUENTIAL", "MADV_WILLNEED"):
+        if hasattr(mmap, advice):
+            mapping.madvise(getattr(mmap, advice))
+    
+    _model_maps[path] = mapping
+
+def _transcribe_faster_whisper(audio, config):
+    """
+    Transcribe audio in-process using faster-whisper
+    
+    Args:
+        audio: 16 kHz mono int16 samples
+        config: Whisper configuration (WhisperCfg)
+        
+    Returns:
+        Transcribed text
+    """
+    # faster-whisper wants floats; convert in place so only one copy is made
+    samples = audio.astype(np.float32)
+    samples *= 1 / 32768
+    
+    model = _get_model(config)
+    segments, _ = model.transcribe(
+        samples,
+        language=config.language,
+        beam_size=1,
+        vad_filter=True
+    )
+    return " ".join(segment.text.strip() for segment in segments)
+
+def _transcribe_whisper_cpp(audio_file, config):
+    """
+    Transcribe audio using the whisper.cpp executable
     
     Args:
         audio_file: Path to the audio file
-        config: Whisper configuration
+        config: Whisper configuration (WhisperCfg)
         
     Returns:
         Transcribed text
     """
-    whisper_executable = Path(config["executable"])
+    whisper_executable = Path(config.executable)
     
     if not whisper_executable.exists():
         raise FileNotFoundError(
@@ -26,17 +190,21 @@ def transcribe_audio(audio_file, config):
             "Please install whisper.cpp and update the config."
         )
     
+    model_file = f"./whisper.cpp/models/ggml-{config.model}.bin"
+    if os.path.exists(model_file):
+        # whisper.cpp reloads the model every run; keep it in the page cache
+        _map_model_file(model_file)
+    
     cmd = [
         str(whisper_executable),
         "-f", str(audio_file),
-        "-m", f"./whisper.cpp/models/ggml-{config['model']}.bin",
-        "-otxt"
+        "-m", model_file,
+        # Print the bare transcript to stdout rather than writing a .txt file
+        "--no-timestamps"
     ]
     
     # Add any additional parameters from config
-    if "params" in config:
-        for param in config["params"].split():
-            cmd.append(param)
+    cmd.extend(config.params.split())
     
     try:
         result = subprocess.run(
@@ -46,19 +214,23 @@ def transcribe_audio(audio_file, config):
             check=True
         )
         
-        # Whisper.cpp outputs to a file with .txt extension
-        output_file = Path(str(audio_file).replace(Path(audio_file).suffix, ".txt"))
+        # One line per segment; logs go to stderr
+        return " ".join(line.strip() for line in result.stdout.splitlines() if line.strip())
         
-        if output_file.exists():
-            with open(output_file, "r") as f:
-                transcript = f.read().strip()
-            os.remove(output_file)  # Clean up
-            return transcript
-        else:
-            # If no output file, try to get from stdout
-            return result.stdout.strip()
-            
     except subprocess.CalledProcessError as e:
-        print(f"Error running whisper.cpp: {e}")
-        print(f"stderr: {e.stderr}")
-        return ""
\ No newline at end of file
+        log.error("Error running whisper.cpp: %s\nstderr: %s", e, e.stderr)
+        return ""
+
+def _write_wav(audio, path):
+    """
+    Write samples to a 16-bit mono WAV file
+    
+    Args:
+        audio: 16 kHz mono int16 samples
+        path: Path of the WAV file to write
+    """
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(audio.astype("<i2", copy=False).tobytes())